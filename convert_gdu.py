@@ -2,20 +2,51 @@
 """
 Convert GDU JSON export to Parquet with a tree-optimized schema.
 Streams JSON and writes parquet in batches to keep memory bounded.
+
+Runtime deps: ijson, numpy, pyarrow. JSON tokenizing is the hot path, so install
+libyajl (2.x) to get ijson's C backend; the pure-Python fallback is ~30x slower.
 """
 
 import argparse
 import os
+import queue
 import sys
+import threading
 from dataclasses import dataclass
-from typing import Iterator, Optional, List
+from typing import Iterator, Optional, List, Tuple
 
-import ijson
+try:
+    from ijson.backends import yajl2_c as ijson_backend
+except ImportError:
+    try:
+        from ijson.backends import yajl2_cffi as ijson_backend
+    except ImportError:
+        import ijson as ijson_backend
+import numpy as np
+
+# Arrow reads this once at import. pyarrow wheels default to mimalloc, but
+# jemalloc returns freed batch memory more readily and gives a lower peak RSS
+# on large trees; set the variable yourself to pick another backend.
+os.environ.setdefault("ARROW_DEFAULT_MEMORY_POOL", "jemalloc")
 import pyarrow as pa
 import pyarrow.parquet as pq
 
 
 BATCH_SIZE = 100_000
+BATCHES_PER_ROW_GROUP = 10
+ROW_GROUP_SIZE = BATCH_SIZE * BATCHES_PER_ROW_GROUP
+DATA_PAGE_SIZE = 1024 * 1024
+# Batches waiting for the writer thread; bounds memory if writing lags.
+WRITE_QUEUE_SIZE = 4
+# Columns that repeat heavily across a tree. path, size and usage are close
+# to unique per row, so a dictionary would only cost space there. The raised
+# page limit keeps large name/parent dictionaries from falling back to plain.
+DICTIONARY_COLUMNS = ['name', 'parent', 'depth', 'item_count']
+DICTIONARY_PAGE_SIZE_LIMIT = 64 * 1024 * 1024
+# zstd at level 1 compresses the shared path prefixes well for little extra CPU.
+DEFAULT_COMPRESSION = 'zstd'
+COMPRESSION_LEVELS = {'zstd': 1}
+READ_BUFFER_SIZE = 4 * 1024 * 1024
 
 SCHEMA = pa.schema([
     ('path', pa.string()),
@@ -28,6 +59,22 @@ SCHEMA = pa.schema([
     ('item_count', pa.int64()),
 ])
 
+# Output paths are POSIX-style whatever platform runs the conversion.
+_SEP = "/"
+
+# The only per-entry fields the converter reads.
+NCDU_FIELDS = frozenset(("name", "asize", "dsize"))
+
+# Kinds of JSON array in an NCDU dump: a directory is [info, child, ...];
+# anything else (the outer [version, version, meta, root]) is "top".
+ARRAY_UNKNOWN = 0
+ARRAY_TOP = 1
+ARRAY_DIR = 2
+
+# Rows are plain tuples in SCHEMA column order. size and usage carry the raw
+# asize/dsize JSON values; ColumnBatch coerces them a whole batch at a time.
+Row = Tuple[str, str, str, int, object, object, bool, int]
+
 
 @dataclass
 class DirFrame:
@@ -35,22 +82,24 @@ class DirFrame:
     path: str
     parent: str
     depth: int
-    size: int
-    usage: int
+    size: object
+    usage: object
+    child_prefix: str
     item_count: int = 0
 
 
-def _build_path(parent_path: str, name: str) -> str:
-    if parent_path:
-        current_path = os.path.join(parent_path, name)
-    else:
-        current_path = name or "/"
-    if not current_path.startswith("/"):
-        current_path = "/" + current_path
-    return current_path
+def _build_path(parent: Optional[DirFrame], name: str) -> str:
+    if parent is not None:
+        return parent.child_prefix + name
+    if name.startswith(_SEP):
+        return name
+    return _SEP + name
 
 
 def _coerce_int(value) -> int:
+    # ijson yields plain ints for nearly every size; skip the try for them.
+    if value.__class__ is int:
+        return value
     if value is None:
         return 0
     try:
@@ -59,169 +108,349 @@ def _coerce_int(value) -> int:
         return 0
 
 
+def _coerce_int_column(raw: list) -> np.ndarray:
+    """
+    Return _coerce_int of each raw value as an int64 array.
+    NumPy's object->int64 cast matches int() and runs in C; anything it
+    rejects (None, junk strings, overflow) takes the per-value path.
+    """
+    out = np.empty(len(raw), dtype=np.int64)
+    try:
+        out[:] = np.array(raw, dtype=object)
+    except (TypeError, ValueError, OverflowError):
+        for i, value in enumerate(raw):
+            out[i] = _coerce_int(value)
+    return out
+
+
 def _make_dir_frame(info: dict, parent: Optional[DirFrame]) -> DirFrame:
     name = info.get("name", "") or ""
     parent_path = parent.path if parent else ""
     depth = (parent.depth + 1) if parent else 0
-    current_path = _build_path(parent_path, name)
+    current_path = _build_path(parent, name)
     return DirFrame(
         name=name or "/",
         path=current_path,
         parent=parent_path,
         depth=depth,
-        size=_coerce_int(info.get("asize", 0)),
-        usage=_coerce_int(info.get("dsize", 0)),
+        size=info.get("asize", 0),
+        usage=info.get("dsize", 0),
+        # Children are a single concat; a trailing "/" (e.g. a "/" root)
+        # is not doubled, matching what os.path.join produced.
+        child_prefix=current_path if current_path.endswith(_SEP) else current_path + _SEP,
     )
 
 
-def _make_file_row(info: dict, parent: Optional[DirFrame]) -> Optional[dict]:
+def _make_file_row(info: dict, parent: Optional[DirFrame]) -> Optional[Row]:
     name = info.get("name", "")
     if name is None:
         name = ""
     if name == "":
         return None
-    parent_path = parent.path if parent else ""
-    depth = (parent.depth + 1) if parent else 0
-    current_path = _build_path(parent_path, name)
-    return {
-        "path": current_path,
-        "name": name,
-        "parent": parent_path,
-        "depth": depth,
-        "size": _coerce_int(info.get("asize", 0)),
-        "usage": _coerce_int(info.get("dsize", 0)),
-        "is_dir": False,
-        "item_count": 0,
-    }
-
-
-def _dir_frame_to_row(frame: DirFrame) -> dict:
-    return {
-        "path": frame.path,
-        "name": frame.name or "/",
-        "parent": frame.parent,
-        "depth": frame.depth,
-        "size": frame.size,
-        "usage": frame.usage,
-        "is_dir": True,
-        "item_count": frame.item_count,
-    }
-
-
-def stream_nodes(filepath: str) -> Iterator[dict]:
+    # Files far outnumber directories, so _build_path is inlined here.
+    if parent is not None:
+        parent_path = parent.path
+        depth = parent.depth + 1
+        current_path = parent.child_prefix + name
+    else:
+        parent_path = ""
+        depth = 0
+        current_path = _build_path(None, name)
+    return (
+        current_path,
+        name,
+        parent_path,
+        depth,
+        info.get("asize", 0),
+        info.get("dsize", 0),
+        False,
+        0,
+    )
+
+
+def _dir_frame_to_row(frame: DirFrame) -> Row:
+    return (
+        frame.path,
+        frame.name or "/",
+        frame.parent,
+        frame.depth,
+        frame.size,
+        frame.usage,
+        True,
+        frame.item_count,
+    )
+
+
+def _skip_container(events):
+    """Consume events up to the end of a container whose start was just read."""
+    nesting = 1
+    for event, _ in events:
+        if event == "start_map" or event == "start_array":
+            nesting += 1
+        elif event == "end_map" or event == "end_array":
+            nesting -= 1
+            if nesting == 0:
+                return
+
+
+def _read_object(events) -> dict:
+    """
+    Consume events up to the end of the current object.
+    Each key is read together with its value, so a field costs one loop
+    iteration; only the NCDU_FIELDS scalars are kept and nested containers
+    (never present in gdu output) are skipped wholesale.
+    """
+    data = {}
+    for event, key in events:
+        if event == "end_map":
+            return data
+        # Anything else is a map_key, and the next event is its value.
+        event, value = next(events)
+        if event == "start_map" or event == "start_array":
+            _skip_container(events)
+        elif key in NCDU_FIELDS:
+            data[key] = value
+    return data
+
+
+def stream_nodes(filepath: str) -> Iterator[Row]:
     """
     Stream NCDU-format JSON and yield rows.
     Directories are emitted post-order so item_count can be computed.
+    Objects are consumed whole by _read_object, so only array structure
+    goes through the dispatch below.
     """
-    with open(filepath, "rb") as f:
-        parser = ijson.basic_parse(f)
-
-        container_stack = []
+    # ijson does its own buffered reads, so skip Python's buffer layer.
+    with open(filepath, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            try:
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            except OSError:
+                pass  # Only a readahead hint; pipes and some filesystems refuse it.
+        parser = ijson_backend.basic_parse(
+            f, buf_size=READ_BUFFER_SIZE, multiple_values=False, use_float=False,
+        )
+
+        # Parallel stacks, one entry per open array: its kind, how many
+        # elements it has seen, and its DirFrame if it is a directory.
+        stack_type: List[int] = []
+        stack_index: List[int] = []
+        stack_frame: List[Optional[DirFrame]] = []
         dir_stack: List[DirFrame] = []
+        # Innermost open directory, i.e. dir_stack[-1] or None.
+        current: Optional[DirFrame] = None
 
         for event, value in parser:
+            if event == "start_map":
+                data = _read_object(parser)
+
+                if stack_type:
+                    array_type = stack_type[-1]
+                    index = stack_index[-1]
+                    if array_type == ARRAY_UNKNOWN and index == 0:
+                        array_type = ARRAY_DIR if data else ARRAY_TOP
+                        stack_type[-1] = array_type
+
+                    if array_type == ARRAY_DIR:
+                        if index == 0 and stack_frame[-1] is None:
+                            current = _make_dir_frame(data, current)
+                            stack_frame[-1] = current
+                            dir_stack.append(current)
+                        else:
+                            row = _make_file_row(data, current)
+                            if row is not None:
+                                yield row
+                                if current is not None:
+                                    current.item_count += 1
+
+                    stack_index[-1] = index + 1
+                else:
+                    row = _make_file_row(data, None)
+                    if row is not None:
+                        yield row
+                continue
+
             if event == "start_array":
-                arr_ctx = {"type": "unknown", "index": 0, "frame": None}
-                container_stack.append({"type": "array", "ctx": arr_ctx})
+                stack_type.append(ARRAY_UNKNOWN)
+                stack_index.append(0)
+                stack_frame.append(None)
                 continue
 
             if event == "end_array":
-                arr_ctx = container_stack.pop()["ctx"]
-                if arr_ctx["type"] == "dir" and arr_ctx.get("frame") is not None:
-                    frame = arr_ctx["frame"]
+                array_type = stack_type.pop()
+                stack_index.pop()
+                frame = stack_frame.pop()
+                if array_type == ARRAY_DIR and frame is not None:
                     yield _dir_frame_to_row(frame)
-                    if dir_stack and dir_stack[-1] is frame:
+                    if current is frame:
                         dir_stack.pop()
-                    if dir_stack:
-                        dir_stack[-1].item_count += frame.item_count
+                        current = dir_stack[-1] if dir_stack else None
+                    if current is not None:
+                        current.item_count += frame.item_count
 
-                if container_stack and container_stack[-1]["type"] == "array":
-                    container_stack[-1]["ctx"]["index"] += 1
+                if stack_index:
+                    stack_index[-1] += 1
                 continue
 
-            if event == "start_map":
-                obj_ctx = {"data": {}, "key": None}
-                container_stack.append({"type": "object", "ctx": obj_ctx})
-                continue
+            # Scalars outside objects only appear in arrays (e.g. the header).
+            if stack_type:
+                if stack_type[-1] == ARRAY_UNKNOWN and stack_index[-1] == 0:
+                    stack_type[-1] = ARRAY_TOP
+                stack_index[-1] += 1
 
-            if event == "map_key":
-                container_stack[-1]["ctx"]["key"] = value
-                continue
 
-            if event in ("string", "number", "boolean", "null"):
-                if not container_stack:
-                    continue
-                top = container_stack[-1]
-                if top["type"] == "object":
-                    key = top["ctx"]["key"]
-                    if key == "name":
-                        top["ctx"]["data"]["name"] = value
-                    elif key in ("asize", "dsize"):
-                        top["ctx"]["data"][key] = _coerce_int(value)
-                elif top["type"] == "array":
-                    arr_ctx = top["ctx"]
-                    if arr_ctx["type"] == "unknown" and arr_ctx["index"] == 0:
-                        arr_ctx["type"] = "top"
-                    arr_ctx["index"] += 1
-                continue
+class ColumnBatch:
+    """
+    Per-column Python lists for one parquet batch.
+    Appending to a list is far cheaper than a NumPy or Arrow builder call
+    per value, and pa.array converts each whole list in one C pass.
+    """
 
-            if event == "end_map":
-                obj_ctx = container_stack.pop()["ctx"]
-                data = obj_ctx["data"]
-                parent = container_stack[-1] if container_stack else None
-
-                if parent and parent["type"] == "array":
-                    arr_ctx = parent["ctx"]
-                    if arr_ctx["type"] == "unknown" and arr_ctx["index"] == 0:
-                        arr_ctx["type"] = "dir" if data else "top"
-
-                    if arr_ctx["type"] == "dir":
-                        if arr_ctx["index"] == 0 and arr_ctx.get("frame") is None:
-                            frame = _make_dir_frame(data, dir_stack[-1] if dir_stack else None)
-                            arr_ctx["frame"] = frame
-                            dir_stack.append(frame)
-                        else:
-                            row = _make_file_row(data, dir_stack[-1] if dir_stack else None)
-                            if row is not None:
-                                yield row
-                                if dir_stack:
-                                    dir_stack[-1].item_count += 1
+    def __init__(self, capacity: int = BATCH_SIZE):
+        self.capacity = capacity
+        self.paths = []
+        self.names = []
+        self.parents = []
+        self.depths = []
+        self.sizes = []
+        self.usages = []
+        self.is_dirs = []
+        self.item_counts = []
+        self._columns = (
+            self.paths, self.names, self.parents, self.depths,
+            self.sizes, self.usages, self.is_dirs, self.item_counts,
+        )
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def append(self, row: Row):
+        path, name, parent, depth, size, usage, is_dir, item_count = row
+        self.paths.append(path)
+        self.names.append(name)
+        self.parents.append(parent)
+        self.depths.append(depth)
+        self.sizes.append(size)
+        self.usages.append(usage)
+        self.is_dirs.append(is_dir)
+        self.item_counts.append(item_count)
+
+    def is_full(self) -> bool:
+        return len(self.paths) >= self.capacity
+
+    def to_record_batch(self) -> pa.RecordBatch:
+        """Convert the buffered rows and empty the lists for reuse."""
+        arrays = []
+        for col, field in zip(self._columns, SCHEMA):
+            if field.name in ('size', 'usage'):
+                arrays.append(pa.array(_coerce_int_column(col), type=field.type))
+            else:
+                arrays.append(pa.array(col, type=field.type))
+        for col in self._columns:
+            col.clear()
+        return pa.RecordBatch.from_arrays(arrays, schema=SCHEMA)
+
+
+def _open_writer(output_path: str, compression: str) -> pq.ParquetWriter:
+    return pq.ParquetWriter(
+        output_path,
+        SCHEMA,
+        compression=compression,
+        compression_level=COMPRESSION_LEVELS.get(compression),
+        use_dictionary=DICTIONARY_COLUMNS,
+        dictionary_pagesize_limit=DICTIONARY_PAGE_SIZE_LIMIT,
+        data_page_size=DATA_PAGE_SIZE,
+    )
 
-                    arr_ctx["index"] += 1
-                else:
-                    row = _make_file_row(data, None)
-                    if row is not None:
-                        yield row
-                continue
 
+def _write_row_group(writer: pq.ParquetWriter, batches: List[pa.RecordBatch]):
+    table = pa.Table.from_batches(batches, schema=SCHEMA)
+    writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
 
-def write_batched_parquet(rows: Iterator[dict], output_path: str):
-    """Write rows to parquet in batches to bound memory."""
+
+def _write_row_groups(batches: queue.Queue, output_path: str, compression: str,
+                      errors: List[Exception]):
+    """
+    Writer thread: gather queued record batches into row groups and write
+    them until None arrives. Failures are recorded in errors; later batches
+    are drained and dropped so the producer never blocks on a full queue.
+    """
     writer = None
-    batch = []
+    pending: List[pa.RecordBatch] = []
+    written = 0
+
+    while True:
+        record_batch = batches.get()
+        if errors:
+            if record_batch is None:
+                break
+            continue
+        if record_batch is not None:
+            pending.append(record_batch)
+            if len(pending) < BATCHES_PER_ROW_GROUP:
+                continue
+        if pending:
+            try:
+                if writer is None:
+                    writer = _open_writer(output_path, compression)
+                _write_row_group(writer, pending)
+            except Exception as exc:
+                errors.append(exc)
+            else:
+                written += sum(batch.num_rows for batch in pending)
+                print(f"  Written {written:,} rows...")
+            pending = []
+        if record_batch is None:
+            break
+
+    if writer:
+        try:
+            writer.close()
+        except Exception as exc:
+            errors.append(exc)
+
+
+def write_batched_parquet(rows: Iterator[Row], output_path: str,
+                          compression: str = DEFAULT_COMPRESSION):
+    """
+    Write rows to parquet in batches to bound memory.
+    Each full batch goes to a writer thread, which buffers batches until
+    they fill a row group (the writer closes a row group on every write
+    call) and encodes it while parsing continues; pyarrow releases the
+    GIL there.
+    """
+    batch = ColumnBatch()
     total_rows = 0
 
-    for row in rows:
-        batch.append(row)
-        total_rows += 1
-
-        if len(batch) >= BATCH_SIZE:
-            table = pa.Table.from_pylist(batch, schema=SCHEMA)
-            if writer is None:
-                writer = pq.ParquetWriter(output_path, SCHEMA, compression='snappy')
-            writer.write_table(table)
-            print(f"  Written {total_rows:,} rows...")
-            batch = []
-
-    # Write remaining rows
-    if batch:
-        table = pa.Table.from_pylist(batch, schema=SCHEMA)
-        if writer is None:
-            writer = pq.ParquetWriter(output_path, SCHEMA, compression='snappy')
-        writer.write_table(table)
+    batches: queue.Queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+    errors: List[Exception] = []
+    worker = threading.Thread(
+        target=_write_row_groups,
+        args=(batches, output_path, compression, errors),
+        name="parquet-writer",
+        daemon=True,
+    )
+    worker.start()
 
-    if writer:
-        writer.close()
+    try:
+        for row in rows:
+            batch.append(row)
+            total_rows += 1
+
+            if batch.is_full():
+                if errors:
+                    break
+                batches.put(batch.to_record_batch())
+
+        # Write remaining rows
+        if len(batch) and not errors:
+            batches.put(batch.to_record_batch())
+    finally:
+        batches.put(None)
+        worker.join()
+
+    if errors:
+        raise errors[0]
 
     return total_rows
 
@@ -232,6 +461,12 @@ def main():
     )
     parser.add_argument('--input', '-i', required=True, help='Input GDU JSON file')
     parser.add_argument('--output', '-o', required=True, help='Output Parquet file')
+    parser.add_argument(
+        '--compression',
+        choices=['zstd', 'snappy', 'lz4', 'gzip', 'none'],
+        default=DEFAULT_COMPRESSION,
+        help=f'Parquet compression codec (default: {DEFAULT_COMPRESSION})',
+    )
     args = parser.parse_args()
 
     if not os.path.exists(args.input):
@@ -241,7 +476,7 @@ def main():
     print("Parsing tree structure...")
 
     rows = stream_nodes(args.input)
-    total = write_batched_parquet(rows, args.output)
+    total = write_batched_parquet(rows, args.output, compression=args.compression)
 
     print(f"Success! Wrote {total:,} rows to {args.output}")
 